@@ -1,20 +1,16 @@
 from airflow import DAG
-from airflow.operators.python import PythonOperator, BranchPythonOperator
+from airflow.operators.python import PythonOperator, ShortCircuitOperator
 from airflow.operators.dummy import DummyOperator
+from airflow.sensors.python import PythonSensor
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
-import pandas as pd
-import requests
-from src.data_loader import (
-    fetch_data, save_raw_data, load_raw_data,
-    save_to_postgres, load_from_postgres, get_reference_data,
-    log_drift_result, get_latest_batch_id
-)
-from src.preprocessing import clean_data
-from src.drift_detection import detect_drift
-from src.model_training import train_and_log_model
-import mlflow
+
+logger = logging.getLogger(__name__)
+
+# pandas, mlflow and the src.* modules are imported inside the task callables
+# so that parsing this file in the scheduler stays cheap.
 
 default_args = {
     'owner': 'airflow',
@@ -27,72 +23,181 @@ default_args = {
 }
 
 # S3 keys (for backup)
-CURRENT_BATCH_KEY = "current_batch.csv"
-REFERENCE_KEY = "reference.csv"
+CURRENT_BATCH_KEY = "current_batch.parquet"
+REFERENCE_KEY = "reference.parquet"
 
 # API URL for model reload
 API_URL = os.getenv("API_URL", "http://api:8000")
+RELOAD_TRIGGER_TIMEOUT = 5
+RELOAD_WAIT_TIMEOUT = 600
+
+MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://mlflow:5000")
+
+# Max rows per side fed to the KS test; larger samples barely change the decision
+DRIFT_SAMPLE_SIZE = int(os.getenv("DRIFT_SAMPLE_SIZE", "20000"))
 
 def ingest_data(**kwargs):
     """
     Fetch data from external API and save to PostgreSQL + S3 backup.
     """
-    group_number = kwargs.get('templates_dict', {}).get('group_number')
-    day = kwargs.get('templates_dict', {}).get('day')
-    
-    if not group_number:
-        dag_run = kwargs.get('dag_run')
-        if dag_run and dag_run.conf:
-            group_number = dag_run.conf.get('group_number', '5')
-            day = dag_run.conf.get('day', 'Tuesday')
-        else:
-            group_number = '5'
-            day = 'Tuesday'
+    from src.data_loader import fetch_data, save_raw_data, save_to_postgres, get_latest_batch_id
+    
+    dag_run = kwargs.get('dag_run')
+    conf = (dag_run.conf if dag_run else None) or {}
+    group_number = conf.get('group_number', '5')
+    day = conf.get('day', 'Tuesday')
+    force_refresh = bool(conf.get('force_refresh', False))
+    
+    logger.info(f"Starting ingestion for Group: {group_number}, Day: {day}")
+    df = fetch_data(group_number=group_number, day=day, force_refresh=force_refresh)
+    
+    # Upstream returned the same payload as last time: it is already stored
+    if df.attrs.get('from_cache'):
+        batch_id = get_latest_batch_id()
+        if batch_id:
+            logger.info(f"Batch unchanged since last fetch, reusing batch_id: {batch_id}")
+            return batch_id
+    
+    # Save to PostgreSQL (primary storage) and S3 (backup) concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        postgres_future = executor.submit(save_to_postgres, df, 'raw_data')
+        s3_future = executor.submit(save_raw_data, df, CURRENT_BATCH_KEY)
+        
+        batch_id = postgres_future.result()
+        logger.info(f"Data saved to PostgreSQL with batch_id: {batch_id}")
+        
+        try:
+            s3_future.result()
+            logger.info("Backup saved to S3")
+        except Exception as e:
+            logger.warning(f"S3 backup failed (non-critical): {e}")
+    
+    logger.info(f"Ingested {len(df)} records")
+    return batch_id
+
+def load_current_batch(batch_id):
+    """
+    Load a raw batch from PostgreSQL (primary storage), falling back to the
+    S3 backup of the current batch.
+    """
+    from src.data_loader import load_from_postgres, load_raw_data
     
-    logging.info(f"Starting ingestion for Group: {group_number}, Day: {day}")
-    df = fetch_data(group_number=group_number, day=day)
+    logger.info(f"Loading raw data (batch: {batch_id})")
+    df = load_from_postgres('raw_data', batch_id=batch_id)
+    if df is not None and not df.empty:
+        return df
     
-    # Save to PostgreSQL (primary storage)
-    batch_id = save_to_postgres(df, 'raw_data')
-    logging.info(f"Data saved to PostgreSQL with batch_id: {batch_id}")
+    logger.error("Could not load raw data from PostgreSQL, falling back to S3")
+    df = load_raw_data(CURRENT_BATCH_KEY)
+    if df is None or df.empty:
+        raise ValueError("Could not load current data from any source")
+    return df
+
+def sample_for_drift(df):
+    """Subsample a batch to at most DRIFT_SAMPLE_SIZE rows for the KS test."""
+    if len(df) <= DRIFT_SAMPLE_SIZE:
+        return df
+    return df.sample(n=DRIFT_SAMPLE_SIZE, random_state=0)
+
+def load_reference_clean(ref_batch_id):
+    """
+    Load the cleaned reference batch, cleaning it only once.
+    The reference stays the same until a new batch arrives, so its cleaned
+    version is cached in the clean_data table keyed by batch_id.
+    """
+    from src.data_loader import load_from_postgres, save_to_postgres
+    from src.preprocessing import clean_data
+    from src.drift_detection import DRIFT_FEATURES
+    
+    reference_clean = load_from_postgres('clean_data', batch_id=ref_batch_id, columns=DRIFT_FEATURES)
+    if reference_clean is not None and not reference_clean.empty:
+        logger.info(f"Using cached clean reference data (batch: {ref_batch_id})")
+        return reference_clean
     
-    # Save to S3 as backup
+    reference_df = load_from_postgres('raw_data', batch_id=ref_batch_id)
+    if reference_df is None or reference_df.empty:
+        return None
+    
+    reference_clean = clean_data(reference_df)
     try:
-        save_raw_data(df, CURRENT_BATCH_KEY)
-        logging.info("Backup saved to S3")
+        save_to_postgres(reference_clean, 'clean_data', batch_id=ref_batch_id)
     except Exception as e:
-        logging.warning(f"S3 backup failed (non-critical): {e}")
+        logger.warning(f"Could not cache clean reference data (non-critical): {e}")
+    return reference_clean
+
+def load_current_clean(batch_id):
+    """
+    Clean the current batch and materialize it (and its drift baseline) so
+    train_model and the next drift check can reuse it.
+    An unchanged re-fetch keeps the previous batch_id, so rows already in
+    clean_data for the batch are reused instead of being appended again.
+    """
+    from src.data_loader import load_from_postgres, save_to_postgres
+    from src.preprocessing import clean_data
     
-    logging.info(f"Ingested {len(df)} records")
-    return batch_id
+    current_clean = load_from_postgres('clean_data', batch_id=batch_id)
+    if current_clean is not None and not current_clean.empty:
+        logger.info(f"Using cached clean current data (batch: {batch_id})")
+        return current_clean
+    
+    current_clean = clean_data(load_current_batch(batch_id))
+    try:
+        save_to_postgres(current_clean, 'clean_data', batch_id=batch_id)
+    except Exception as e:
+        logger.warning(f"Could not save clean current data (non-critical): {e}")
+    save_batch_baseline(current_clean, batch_id)
+    return current_clean
+
+def save_batch_baseline(df_clean, batch_id):
+    """Store the drift baseline of a clean batch, which becomes the next run's reference."""
+    from src.data_loader import save_baseline
+    from src.drift_detection import build_baseline
+    
+    try:
+        save_baseline(build_baseline(sample_for_drift(df_clean)), batch_id)
+    except Exception as e:
+        logger.warning(f"Could not save drift baseline (non-critical): {e}")
+
+def load_reference_baseline(ref_batch_id):
+    """
+    Load the drift baseline (sorted feature values) of the reference batch.
+    Falls back to rebuilding it from the clean reference batch, e.g. for
+    batches ingested before baselines were stored.
+    """
+    from src.data_loader import load_baseline
+    from src.drift_detection import build_baseline
+    
+    baseline = load_baseline(ref_batch_id)
+    if baseline:
+        logger.info(f"Using stored drift baseline (batch: {ref_batch_id})")
+        return baseline
+    
+    reference_clean = load_reference_clean(ref_batch_id)
+    if reference_clean is None or reference_clean.empty:
+        return None
+    
+    save_batch_baseline(reference_clean, ref_batch_id)
+    return build_baseline(sample_for_drift(reference_clean))
 
 def check_drift(**kwargs):
     """
     Compare current data with reference data to detect drift.
-    Returns 'train_model' if drift detected or first run, 'skip_training' otherwise.
+    Returns True if drift detected or first run (continue to training), False otherwise.
     """
+    from src.data_loader import get_reference_batch_id, log_drift_result
+    from src.drift_detection import detect_drift
+    
+    current_batch_id = None
+    ref_batch_id = None
     try:
         ti = kwargs['ti']
         current_batch_id = ti.xcom_pull(task_ids='ingest_data')
-        
-        logging.info(f"Loading current data (batch: {current_batch_id})")
-        current_df = load_from_postgres('raw_data', batch_id=current_batch_id)
-        
-        if current_df is None or current_df.empty:
-            logging.error("Could not load current data from PostgreSQL")
-            # Fallback to S3
-            current_df = load_raw_data(CURRENT_BATCH_KEY)
-            if current_df is None or current_df.empty:
-                raise ValueError("Could not load current data from any source")
 
-        # Load reference data (previous batch)
-        reference_df = get_reference_data()
+        # Reference data is the previous batch
+        ref_batch_id = get_reference_batch_id()
         
-        if reference_df is None or reference_df.empty:
-            logging.info("="*50)
-            logging.info("FIRST RUN - No reference data found")
-            logging.info("Proceeding to training")
-            logging.info("="*50)
+        if ref_batch_id is None:
+            logger.info({"event": "drift_first_run", "cur_batch": current_batch_id, "action": "train"})
             
             log_drift_result(
                 drift_detected=False,
@@ -102,26 +207,34 @@ def check_drift(**kwargs):
                 current_batch_id=current_batch_id,
                 action_taken='train_first_run'
             )
-            return 'train_model'
+            return True
         
-        # Clean both for drift detection
-        current_clean = clean_data(current_df)
-        reference_clean = clean_data(reference_df)
+        # Clean both for drift detection (independent, so run them concurrently)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            current_future = executor.submit(load_current_clean, current_batch_id)
+            reference_future = executor.submit(load_reference_baseline, ref_batch_id)
+            current_clean = current_future.result()
+            reference_baseline = reference_future.result()
         
-        logging.info(f"Current data: {len(current_clean)} samples")
-        logging.info(f"Reference data: {len(reference_clean)} samples")
-
-        has_drift, drift_details = detect_drift(reference_clean, current_clean, return_details=True)
+        if not reference_baseline:
+            raise ValueError(f"Could not load reference data (batch: {ref_batch_id})")
         
-        # Get reference batch_id
-        ref_batch_id = reference_df['batch_id'].iloc[0] if 'batch_id' in reference_df.columns else 'unknown'
+        logger.info(f"Current data: {len(current_clean)} samples")
+
+        has_drift, drift_details = detect_drift(
+            reference_baseline,
+            sample_for_drift(current_clean),
+            return_details=True
+        )
         
         if has_drift:
-            logging.info("="*50)
-            logging.info("DRIFT DETECTED!")
-            logging.info(f"Features with drift: {drift_details.get('features_with_drift', [])}")
-            logging.info("Proceeding to model retraining...")
-            logging.info("="*50)
+            logger.info({
+                "event": "drift_detected",
+                "features": drift_details.get('features_with_drift', []),
+                "ref_batch": ref_batch_id,
+                "cur_batch": current_batch_id,
+                "action": "retrain",
+            })
             
             log_drift_result(
                 drift_detected=True,
@@ -131,13 +244,15 @@ def check_drift(**kwargs):
                 current_batch_id=current_batch_id,
                 action_taken='retrain'
             )
-            return 'train_model'
+            return True
         else:
-            logging.info("="*50)
-            logging.info("NO DRIFT DETECTED")
-            logging.info("Data distribution is stable")
-            logging.info("Skipping model retraining")
-            logging.info("="*50)
+            logger.info({
+                "event": "no_drift",
+                "max_drift_score": drift_details.get('max_drift_score', 0.0),
+                "ref_batch": ref_batch_id,
+                "cur_batch": current_batch_id,
+                "action": "skip",
+            })
             
             log_drift_result(
                 drift_detected=False,
@@ -147,91 +262,125 @@ def check_drift(**kwargs):
                 current_batch_id=current_batch_id,
                 action_taken='skip'
             )
-            return 'skip_training'
+            return False
             
-    except Exception as e:
-        logging.error(f"Drift Check Failed: {e}")
-        import traceback
-        logging.error(traceback.format_exc())
-        # On error, default to training (safer)
-        return 'train_model'
+    except Exception:
+        logger.exception("Drift check failed, defaulting to training")
+        # On error, default to training (safer) and keep a record of it
+        log_drift_result(
+            drift_detected=False,
+            drift_score=0.0,
+            features_with_drift=[],
+            reference_batch_id=ref_batch_id,
+            current_batch_id=current_batch_id,
+            action_taken='train_on_error'
+        )
+        return True
 
 def train_model(**kwargs):
     """
     Train a new model and register in MLflow.
     Model is automatically promoted to Production if it meets quality thresholds.
     """
+    import mlflow
+    from src.data_loader import load_from_postgres, save_to_postgres
+    from src.preprocessing import clean_data
+    from src.model_training import train_and_log_model
+    
     ti = kwargs['ti']
     current_batch_id = ti.xcom_pull(task_ids='ingest_data')
     
-    logging.info(f"Loading training data (batch: {current_batch_id})")
-    
-    # Load from PostgreSQL
-    df = load_from_postgres('raw_data', batch_id=current_batch_id)
+    # Reuse the clean batch materialized by check_drift when available
+    df_clean = load_from_postgres('clean_data', batch_id=current_batch_id)
     
-    if df is None or df.empty:
-        # Fallback to S3
-        df = load_raw_data(CURRENT_BATCH_KEY)
-        if df is None or df.empty:
-            raise ValueError("Could not load training data from any source")
-    
-    logging.info(f"Training with {len(df)} samples")
+    if df_clean is not None and not df_clean.empty:
+        logger.info(f"Using clean data from check_drift (batch: {current_batch_id})")
+    else:
+        df = load_current_batch(current_batch_id)
+        
+        # Clean data and save to clean_data table
+        df_clean = clean_data(df)
+        save_to_postgres(df_clean, 'clean_data', batch_id=current_batch_id)
+        save_batch_baseline(df_clean, current_batch_id)
     
-    # Clean data and save to clean_data table
-    df_clean = clean_data(df)
-    save_to_postgres(df_clean, 'clean_data', batch_id=current_batch_id)
+    logger.info(f"Training with {len(df_clean)} samples")
     
     # Set MLflow tracking URI
-    mlflow.set_tracking_uri("http://mlflow:5000")
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
     
     # Train and log model (includes automatic promotion if metrics are good)
     run_id, rmse = train_and_log_model(df_clean)
     
-    logging.info(f"Training completed. Run ID: {run_id}, RMSE: ${rmse:,.0f}")
+    logger.info({"event": "training_completed", "run_id": run_id, "rmse": round(float(rmse), 2), "cur_batch": current_batch_id})
     
     return run_id
 
-def reload_api(**kwargs):
+def trigger_reload(**kwargs):
     """
-    Notify the API to reload the model from MLflow.
-    This ensures the API uses the newly promoted Production model.
+    Ask the API to reload the model from MLflow without waiting for it to finish.
+    Returns the run_id of the current Production model, which wait_reload
+    expects the API to report once the reload is done.
     """
-    ti = kwargs['ti']
-    run_id = ti.xcom_pull(task_ids='train_model')
+    import requests
+    from mlflow.tracking import MlflowClient
+    from src.data_loader import SESSION
+    from mlflow.exceptions import MlflowException
+    from src.model_training import MODEL_NAME, PRODUCTION_ALIAS
     
-    logging.info("="*50)
-    logging.info("RELOADING API MODEL")
-    logging.info("="*50)
+    expected_run_id = None
+    try:
+        client = MlflowClient(tracking_uri=MLFLOW_TRACKING_URI)
+        try:
+            expected_run_id = client.get_model_version_by_alias(MODEL_NAME, PRODUCTION_ALIAS).run_id
+        except MlflowException:
+            # Versions promoted before the alias was introduced
+            production = client.get_latest_versions(MODEL_NAME, stages=["Production"])
+            if production:
+                expected_run_id = production[0].run_id
+    except Exception as e:
+        logger.warning({"event": "production_lookup_failed", "error": str(e)})
     
+    # The API keeps reloading after the client gives up; wait_reload tracks completion
     try:
-        response = requests.post(f"{API_URL}/reload", timeout=60)
-        
-        if response.status_code == 200:
-            result = response.json()
-            logging.info("API model reloaded successfully!")
-            logging.info(f"  Model Version: {result.get('model_version')}")
-            logging.info(f"  Model Stage: {result.get('model_stage')}")
-            logging.info(f"  Run ID: {result.get('run_id')}")
-        else:
-            logging.warning(f"API reload returned status {response.status_code}")
-            logging.warning(f"  Response: {response.text}")
-            
+        SESSION.post(f"{API_URL}/reload", timeout=RELOAD_TRIGGER_TIMEOUT)
+    except requests.exceptions.ReadTimeout:
+        pass
     except requests.exceptions.ConnectionError:
-        logging.warning("Could not connect to API for reload")
-        logging.warning("  The API will load the new model on next restart")
+        # Includes ConnectTimeout: the reload never reached the API
+        logger.error({"event": "api_reload_failed", "error": "API unreachable"})
+        raise
     except Exception as e:
-        logging.warning(f"API reload failed: {e}")
-        logging.warning("  The API will load the new model on next restart")
+        logger.warning({"event": "api_reload_failed", "error": str(e), "note": "model loads on next API restart"})
     
-    return "reload_completed"
+    logger.info({"event": "api_reload_triggered", "expected_run_id": expected_run_id})
+    return expected_run_id
 
-def skip_training_task(**kwargs):
+def api_serves_model(**kwargs):
     """
-    Log that training was skipped due to no drift.
+    Sensor check: True once the API reports the run_id returned by trigger_reload
+    (or any loaded model when no Production run was resolved).
     """
-    logging.info("Training skipped - no data drift detected")
-    logging.info("Current model remains in production")
-    return "skipped"
+    from src.data_loader import SESSION
+    
+    expected_run_id = kwargs['ti'].xcom_pull(task_ids='trigger_reload')
+    try:
+        status = SESSION.get(f"{API_URL}/", timeout=5).json()
+    except Exception as e:
+        logger.info({"event": "api_not_ready", "error": str(e)})
+        return False
+    
+    if expected_run_id:
+        done = status.get('model_run_id') == expected_run_id
+    else:
+        done = bool(status.get('model_loaded'))
+    if done:
+        logger.info({
+            "event": "api_reloaded",
+            "model_version": status.get('model_version'),
+            "model_stage": status.get('model_stage'),
+            "run_id": status.get('model_run_id'),
+        })
+    return done
 
 # ============================================
 # DAG DEFINITION
@@ -263,7 +412,7 @@ with DAG(
     
     ### Trigger Parameters
     ```json
-    {"group_number": "5", "day": "Tuesday"}
+    {"group_number": "5", "day": "Tuesday", "force_refresh": false}
     ```
     
     ### Promotion Thresholds
@@ -273,48 +422,50 @@ with DAG(
 
     start = DummyOperator(task_id='start')
 
+    # Upstream errors are retried by Airflow with backoff instead of holding the worker
     ingest = PythonOperator(
         task_id='ingest_data',
         python_callable=ingest_data,
-        provide_context=True,
-        templates_dict={'group_number': '5', 'day': 'Tuesday'}
+        retries=3,
+        retry_delay=timedelta(seconds=30),
+        retry_exponential_backoff=True
     )
 
-    drift_check = BranchPythonOperator(
+    # Skips train/reload when no drift is found; end_pipeline still runs
+    drift_check = ShortCircuitOperator(
         task_id='check_drift',
         python_callable=check_drift,
-        provide_context=True
+        ignore_downstream_trigger_rules=False
     )
 
     train = PythonOperator(
         task_id='train_model',
-        python_callable=train_model,
-        provide_context=True
+        python_callable=train_model
     )
     
-    reload_api_task = PythonOperator(
-        task_id='reload_api',
-        python_callable=reload_api,
-        provide_context=True,
+    trigger_reload_task = PythonOperator(
+        task_id='trigger_reload',
+        python_callable=trigger_reload,
         trigger_rule='all_success'
     )
     
-    skip_training = PythonOperator(
-        task_id='skip_training',
-        python_callable=skip_training_task,
-        provide_context=True
+    # Reschedule mode frees the worker slot between polls; soft_fail keeps a
+    # slow or unreachable API from failing the run (it reloads on restart)
+    wait_reload = PythonSensor(
+        task_id='wait_reload',
+        python_callable=api_serves_model,
+        mode='reschedule',
+        poke_interval=5,
+        timeout=RELOAD_WAIT_TIMEOUT,
+        soft_fail=True
     )
 
     end = DummyOperator(
         task_id='end_pipeline',
-        trigger_rule='none_failed_min_one_success'
+        trigger_rule='none_failed'
     )
 
     # Pipeline flow
-    start >> ingest >> drift_check
-    
-    # If drift detected -> train -> reload API -> end
-    drift_check >> train >> reload_api_task >> end
-    
-    # If no drift -> skip training -> end
-    drift_check >> skip_training >> end
+    # If drift detected -> train -> reload API -> wait for reload -> end
+    # If no drift -> train and reload API are skipped -> end
+    start >> ingest >> drift_check >> train >> trigger_reload_task >> wait_reload >> end
@@ -1,62 +1,173 @@
 import pandas as pd
 import numpy as np
 import logging
-from scipy.stats import ks_2samp
+from scipy.stats import kstwo, ks_2samp
 
-def detect_drift(reference_df, current_df, p_value_threshold=0.05, return_details=False):
+# Numerical features compared between reference and current batches
+DRIFT_FEATURES = ['bed', 'bath', 'acre_lot', 'house_size', 'price']
+
+# Largest sample for which scipy's ks_2samp(method='auto') uses the exact distribution
+KS_EXACT_MAX_N = 10000
+
+def build_baseline(df, features=DRIFT_FEATURES):
+    """
+    Builds the drift baseline of a batch: the sorted non-null values of each feature.
+    
+    This is all the KS test needs from the reference side, so it can be
+    computed once per batch and stored instead of the full DataFrame.
+    
+    Returns:
+        dict mapping feature name to a sorted float32 array
+    """
+    baseline = {}
+    for feature in features:
+        if feature in df.columns:
+            baseline[feature] = np.sort(df[feature].dropna().to_numpy(dtype=np.float32))
+    return baseline
+
+def stack_columns(columns):
+    """
+    Stacks 1D arrays of different lengths into a NaN-padded 2D array, one column each.
+    """
+    matrix = np.full((max((len(c) for c in columns), default=0), len(columns)), np.nan, dtype=np.float32)
+    for j, column in enumerate(columns):
+        matrix[:len(column), j] = column
+    return matrix
+
+def ks_statistics(reference, current):
+    """
+    Two-sample Kolmogorov-Smirnov statistics for every column of two 2D arrays at once.
+    
+    Both samples are merged and sorted once per column; the difference of the
+    empirical CDFs is then a cumulative sum of +1/n_ref and -1/n_curr steps.
+    NaNs are ignored per column. Values are sorted as float32 (half the bytes
+    of float64); the CDF steps are still accumulated in float64.
+    
+    Returns:
+        tuple (statistics, n_ref, n_curr) of per-column arrays
+    """
+    ref_valid = ~np.isnan(reference)
+    curr_valid = ~np.isnan(current)
+    n_ref = ref_valid.sum(axis=0)
+    n_curr = curr_valid.sum(axis=0)
+    
+    values = np.concatenate([reference, current], axis=0)
+    steps = np.concatenate([
+        np.where(ref_valid, 1.0 / np.maximum(n_ref, 1), 0.0),
+        np.where(curr_valid, -1.0 / np.maximum(n_curr, 1), 0.0),
+    ], axis=0)
+    
+    order = np.argsort(values, axis=0, kind='stable')
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    cdf_diff = np.cumsum(np.take_along_axis(steps, order, axis=0), axis=0)
+    
+    # Compare the CDFs only after the last of a run of tied values
+    end_of_run = np.ones(sorted_values.shape, dtype=bool)
+    end_of_run[:-1] = sorted_values[1:] != sorted_values[:-1]
+    statistics = np.max(np.abs(cdf_diff) * end_of_run, axis=0, initial=0.0)
+    return statistics, n_ref, n_curr
+
+def ks_p_values(statistics, n_ref, n_curr, reference=None, current=None):
+    """
+    Two-sample KS p-values for arrays of statistics, as scipy's ks_2samp(method='auto').
+    
+    Columns whose larger sample has more than KS_EXACT_MAX_N values use the
+    asymptotic distribution, in one vectorized call. Smaller columns get
+    scipy's exact p-value when the 2D reference/current arrays are given.
+    """
+    n_ref = np.asarray(n_ref, dtype=np.float64)
+    n_curr = np.asarray(n_curr, dtype=np.float64)
+    en = np.round(n_ref * n_curr / np.maximum(n_ref + n_curr, 1))
+    p_values = np.clip(kstwo.sf(statistics, np.maximum(en, 1)), 0, 1)
+    
+    if reference is not None and current is not None:
+        exact = (np.maximum(n_ref, n_curr) <= KS_EXACT_MAX_N) & (n_ref > 0) & (n_curr > 0)
+        for j in np.flatnonzero(exact):
+            ref_col = reference[:, j]
+            curr_col = current[:, j]
+            p_values[j] = ks_2samp(ref_col[~np.isnan(ref_col)], curr_col[~np.isnan(curr_col)]).pvalue
+    return p_values
+
+def detect_drift(reference_df, current_df, p_value_threshold=0.05, return_details=False,
+                 bonferroni=False):
     """
     Detects data drift using Kolmogorov-Smirnov test on numerical columns.
     
     Args:
-        reference_df: Reference DataFrame (baseline)
+        reference_df: Reference DataFrame, or a baseline dict from build_baseline
         current_df: Current DataFrame to compare
         p_value_threshold: Threshold for drift detection (default 0.05)
         return_details: If True, returns (drift_detected, details_dict)
+        bonferroni: If True, divide the threshold by the number of tested features
     
     Returns:
         If return_details=False: bool (drift detected)
         If return_details=True: tuple (bool, dict with drift details)
     """
-    numerical_features = ['bed', 'bath', 'acre_lot', 'house_size', 'price']
+    numerical_features = DRIFT_FEATURES
     drift_detected = False
     features_with_drift = []
     drift_scores = {}
     max_drift_score = 0.0
     
+    if isinstance(reference_df, dict):
+        reference_columns = reference_df.keys()
+        reference_samples = max((len(v) for v in reference_df.values()), default=0)
+    else:
+        reference_columns = reference_df.columns
+        reference_samples = len(reference_df)
+    
+    features = [f for f in numerical_features if f in reference_columns and f in current_df.columns]
+    if bonferroni and features:
+        p_value_threshold = p_value_threshold / len(features)
+    
+    # One vectorized KS pass over all features
+    if features:
+        if isinstance(reference_df, dict):
+            reference = stack_columns([reference_df[f] for f in features])
+        else:
+            reference = reference_df[features].to_numpy(dtype=np.float32)
+        current = current_df[features].to_numpy(dtype=np.float32)
+        statistics, n_ref, n_curr = ks_statistics(reference, current)
+        p_values = ks_p_values(statistics, n_ref, n_curr, reference, current)
+        
+        # Callers that only need the decision skip the per-feature breakdown
+        if not return_details:
+            testable = (n_ref >= 10) & (n_curr >= 10)
+            drift_detected = bool(np.any(testable & (p_values < p_value_threshold)))
+            logging.info(f"Drift check on {len(features)} features: {'DRIFT DETECTED' if drift_detected else 'NO DRIFT'}")
+            return drift_detected
+    
     logging.info("="*50)
     logging.info("DRIFT DETECTION ANALYSIS")
     logging.info("="*50)
-    logging.info(f"Reference samples: {len(reference_df)}")
+    logging.info(f"Reference samples: {reference_samples}")
     logging.info(f"Current samples: {len(current_df)}")
     logging.info(f"P-value threshold: {p_value_threshold}")
     logging.info("-"*50)
     
-    for feature in numerical_features:
-        if feature in reference_df.columns and feature in current_df.columns:
-            ref_data = reference_df[feature].dropna().values
-            curr_data = current_df[feature].dropna().values
-            
-            if len(ref_data) < 10 or len(curr_data) < 10:
-                logging.warning(f"  {feature}: Insufficient data for KS test")
-                continue
-            
-            # Kolmogorov-Smirnov test
-            statistic, p_value = ks_2samp(ref_data, curr_data)
-            
-            drift_scores[feature] = {
-                'statistic': statistic,
-                'p_value': p_value,
-                'drift': p_value < p_value_threshold
-            }
-            
-            if p_value < p_value_threshold:
-                logging.warning(f"  {feature}: DRIFT DETECTED (KS={statistic:.4f}, p={p_value:.6f})")
-                drift_detected = True
-                features_with_drift.append(feature)
-                if statistic > max_drift_score:
-                    max_drift_score = statistic
-            else:
-                logging.info(f"  {feature}: No drift (KS={statistic:.4f}, p={p_value:.6f})")
+    for j, feature in enumerate(features):
+        if n_ref[j] < 10 or n_curr[j] < 10:
+            logging.warning(f"  {feature}: Insufficient data for KS test")
+            continue
+        
+        statistic = float(statistics[j])
+        p_value = float(p_values[j])
+        
+        drift_scores[feature] = {
+            'statistic': statistic,
+            'p_value': p_value,
+            'drift': p_value < p_value_threshold
+        }
+        
+        if p_value < p_value_threshold:
+            logging.warning(f"  {feature}: DRIFT DETECTED (KS={statistic:.4f}, p={p_value:.6f})")
+            drift_detected = True
+            features_with_drift.append(feature)
+            if statistic > max_drift_score:
+                max_drift_score = statistic
+        else:
+            logging.info(f"  {feature}: No drift (KS={statistic:.4f}, p={p_value:.6f})")
     
     logging.info("-"*50)
     logging.info(f"RESULT: {'DRIFT DETECTED' if drift_detected else 'NO DRIFT'}")
@@ -70,7 +181,7 @@ def detect_drift(reference_df, current_df, p_value_threshold=0.05, return_detail
             'features_with_drift': features_with_drift,
             'drift_scores': drift_scores,
             'max_drift_score': max_drift_score,
-            'reference_samples': len(reference_df),
+            'reference_samples': reference_samples,
             'current_samples': len(current_df)
         }
         return drift_detected, details
@@ -84,24 +195,30 @@ def calculate_psi(reference, current, bins=10):
     PSI 0.1-0.25: Moderate change
     PSI > 0.25: Significant change
     """
-    # Create bins based on reference data
-    min_val = min(reference.min(), current.min())
-    max_val = max(reference.max(), current.max())
+    reference = np.asarray(reference, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    values = np.concatenate([reference, current])
+    
+    min_val = values.min()
+    max_val = values.max()
     
     if min_val == max_val:
         return 0.0
     
+    # Equal-width bins over [min, max], assigned against the edges exactly as
+    # np.histogram does (last bin closed), and counted for both samples with a
+    # single bincount: current rows are offset by `bins`
     bin_edges = np.linspace(min_val, max_val, bins + 1)
-    
-    # Calculate proportions in each bin
-    ref_counts, _ = np.histogram(reference, bins=bin_edges)
-    curr_counts, _ = np.histogram(current, bins=bin_edges)
+    bin_idx = np.searchsorted(bin_edges, values, side='right') - 1
+    np.minimum(bin_idx, bins - 1, out=bin_idx)
+    bin_idx[len(reference):] += bins
+    counts = np.bincount(bin_idx, minlength=2 * bins)
     
     # Add small value to avoid division by zero
-    ref_proportions = (ref_counts + 1) / (len(reference) + bins)
-    curr_proportions = (curr_counts + 1) / (len(current) + bins)
+    ref_proportions = (counts[:bins] + 1) / (len(reference) + bins)
+    curr_proportions = (counts[bins:] + 1) / (len(current) + bins)
     
     # Calculate PSI
     psi = np.sum((curr_proportions - ref_proportions) * np.log(curr_proportions / ref_proportions))
     
-    return psi
+    return float(psi)
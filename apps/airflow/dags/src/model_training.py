@@ -10,13 +10,20 @@ import shap
 import joblib
 import logging
 import os
+import json
+import hashlib
+import inspect
+import warnings
+import tempfile
 from datetime import datetime
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
-from sklearn.preprocessing import StandardScaler
+from functools import lru_cache
+from joblib import Memory
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import root_mean_squared_error
 from sklearn.pipeline import Pipeline
-from sklearn.compose import ColumnTransformer, TransformedTargetRegressor
+from sklearn.compose import ColumnTransformer
 from sklearn.impute import SimpleImputer
+from sklearn.ensemble import HistGradientBoostingRegressor
 
 # Try to import XGBoost, fall back to HistGradientBoosting
 try:
@@ -24,36 +31,182 @@ try:
     USE_XGBOOST = True
     logging.info("Using XGBoost")
 except ImportError:
-    from sklearn.ensemble import HistGradientBoostingRegressor
     USE_XGBOOST = False
     logging.info("XGBoost not available, using HistGradientBoostingRegressor")
 
+
+def _cuda_available():
+    """Probe whether XGBoost can actually train on a GPU."""
+    if not USE_XGBOOST:
+        return False
+    try:
+        probe = xgb.XGBRegressor(device="cuda", n_estimators=1)
+        with warnings.catch_warnings():
+            # Without a visible GPU XGBoost falls back to CPU with a warning; read the effective device
+            warnings.simplefilter("ignore")
+            probe.fit(np.zeros((2, 1), dtype=np.float32), np.zeros(2, dtype=np.float32))
+        config = json.loads(probe.get_booster().save_config())
+        return config['learner']['generic_param']['device'].startswith('cuda')
+    except Exception:
+        return False
+
+
+@lru_cache(maxsize=1)
+def xgb_device():
+    """XGBoost device for training, probed on first use so importing this module stays cheap."""
+    device = "cuda" if _cuda_available() else "cpu"
+    logging.info(f"XGBoost device: {device}")
+    return device
+
 # Try to import Optuna
 try:
     import optuna
-    from optuna.integration import OptunaSearchCV
     USE_OPTUNA = True
     logging.info("Optuna available for hyperparameter tuning")
 except ImportError:
     USE_OPTUNA = False
     logging.info("Optuna not available, using default hyperparameters")
 
+# Pruning callback for XGBoost lives in optuna-integration (optional)
+try:
+    from optuna.integration import XGBoostPruningCallback
+except ImportError:
+    XGBoostPruningCallback = None
+
+# xxhash is optional; fall back to hashlib's blake2b
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Numba is optional: MAPE in a single fused pass over large arrays
+try:
+    from numba import njit, prange
+    USE_NUMBA = True
+except ImportError:
+    USE_NUMBA = False
+
+# Optional ONNX export (skl2onnx for sklearn, onnxmltools for XGBoost)
+try:
+    from skl2onnx import to_onnx
+    from skl2onnx.common.data_types import FloatTensorType
+    USE_ONNX = True
+except ImportError:
+    USE_ONNX = False
+
+try:
+    import onnxmltools
+except ImportError:
+    onnxmltools = None
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 MODEL_NAME = "real_estate_model"
+# Registry alias pointing at the production version (resolved in a single call)
+PRODUCTION_ALIAS = "production"
+
+# Backends supported by train_and_log_model (None = xgboost if installed)
+MODEL_BACKENDS = ("xgboost", "hist")
 
 # Promotion thresholds
 R2_THRESHOLD = 0.35
 RMSE_THRESHOLD = 700000  # $700K
 
+# On-disk cache of engineered features, keyed by the DataFrame contents
+FEATURE_CACHE_DIR = os.getenv("FEATURE_CACHE_DIR", "/tmp/joblib_cache")
+FEATURE_CACHE_LIMIT = os.getenv("FEATURE_CACHE_LIMIT", "1G")
+feature_memory = Memory(FEATURE_CACHE_DIR, verbose=0)
+# Bump when feature semantics change outside engineer_features/create_state_encoding
+FEATURE_VERSION = "1"
+
+# Input tensor name of the ONNX model (the API uses it in session.run)
+ONNX_INPUT_NAME = "input"
+ONNX_OPSET = 15
+
+# Rounds without validation improvement before an XGBoost trial stops
+EARLY_STOPPING_ROUNDS = 20
+
+# Optuna: parallel trials and optional storage (e.g. sqlite:////tmp/optuna.db)
+OPTUNA_N_JOBS = int(os.getenv("OPTUNA_N_JOBS", "4"))
+OPTUNA_STORAGE = os.getenv("OPTUNA_STORAGE")
+
+# Derived features built by engineer_features (same order as the NumPy block)
+DERIVED_FEATURES = [
+    'bed_bath_interaction', 'size_per_bed', 'size_per_bath',
+    'total_rooms', 'lot_to_house_ratio'
+]
+
+
+if USE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _mape_kernel(y_true, y_pred):
+        total = 0.0
+        count = 0
+        for i in prange(len(y_true)):
+            if y_true[i] != 0:
+                total += abs((y_true[i] - y_pred[i]) / y_true[i])
+                count += 1
+        if count == 0:
+            return np.nan
+        return 100.0 * total / count
+
 
 def calculate_mape(y_true, y_pred):
     """Calculate Mean Absolute Percentage Error."""
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    if USE_NUMBA:
+        return _mape_kernel(y_true, y_pred)
     mask = y_true != 0
     return np.mean(np.abs((y_true[mask] - y_pred[mask]) / y_true[mask])) * 100
 
 
+def regression_metrics(y_true, y_pred):
+    """
+    RMSE, MAE, R2 and MAPE from a single residual vector.
+    
+    Residuals are computed once (float64) and reused by every metric instead
+    of one full pass per sklearn metric call.
+    
+    Returns:
+        dict with rmse, mae, r2 and mape
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    resid = y_pred - y_true
+    ss_res = np.dot(resid, resid)
+    centered = y_true - y_true.mean()
+    ss_tot = np.dot(centered, centered)
+    return {
+        "rmse": float(np.sqrt(ss_res / len(resid))),
+        "mae": float(np.abs(resid).mean()),
+        "r2": float(1.0 - ss_res / ss_tot) if ss_tot > 0 else 0.0,
+        "mape": float(calculate_mape(y_true, y_pred))
+    }
+
+
+def quantile_bounds(values, lower=0.01, upper=0.99):
+    """
+    Lower/upper quantiles (linear interpolation, like pandas) in one O(n) pass.
+    
+    Uses a single np.partition over the four neighbouring order statistics
+    instead of sorting the column twice.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.nan, np.nan
+    
+    positions = np.array([lower, upper]) * (len(values) - 1)
+    lo = np.floor(positions).astype(np.int64)
+    hi = np.ceil(positions).astype(np.int64)
+    part = np.partition(values, np.unique(np.concatenate([lo, hi])))
+    lo_vals, hi_vals = part[lo], part[hi]
+    bounds = lo_vals + (hi_vals - lo_vals) * (positions - lo)
+    return bounds[0], bounds[1]
+
+
 def log_transform(y):
     """Log transform for target variable."""
     return np.log1p(y)
@@ -76,39 +229,134 @@ def engineer_features(df):
     - total_rooms: bed + bath
     - lot_to_house_ratio: acre_lot * 43560 / (house_size + 1)
     - state_price_mean: Target encoding for state
-    """
-    df = df.copy()
     
+    The columns are added to ``df`` in place (no defensive copy); callers
+    that need the original frame untouched must pass a copy.
+    """
     # Basic feature engineering
-    df['is_sold'] = (df['status'] == 'sold').astype(int) if 'status' in df.columns else 0
-    df['bed_bath_interaction'] = df['bed'] * df['bath']
-    df['size_per_bed'] = df['house_size'] / (df['bed'] + 1)
-    df['size_per_bath'] = df['house_size'] / (df['bath'] + 1)
-    df['total_rooms'] = df['bed'] + df['bath']
-    df['lot_to_house_ratio'] = df['acre_lot'] * 43560 / (df['house_size'] + 1)
+    df['is_sold'] = (df['status'] == 'sold').astype(np.int8) if 'status' in df.columns else np.int8(0)
+    
+    # Derived features are computed in one float32 block (one contiguous row per column)
+    bed, bath, lot, size = np.ascontiguousarray(
+        df[['bed', 'bath', 'acre_lot', 'house_size']].to_numpy(dtype=np.float32).T
+    )
+    out = np.empty((len(DERIVED_FEATURES), len(df)), dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.multiply(bed, bath, out=out[0])
+        np.divide(size, bed + 1, out=out[1])
+        np.divide(size, bath + 1, out=out[2])
+        np.add(bed, bath, out=out[3])
+        np.divide(lot * 43560, size + 1, out=out[4])
     
-    # Handle infinites
-    df.replace([np.inf, -np.inf], np.nan, inplace=True)
+    # Handle infinites: only the derived features can produce them (divisions)
+    out[np.isinf(out)] = np.nan
+    df[DERIVED_FEATURES] = out.T
     
     return df
 
 
 def create_state_encoding(df, target_col='price'):
     """Create target encoding for state."""
-    state_means = df.groupby('state')[target_col].mean().to_dict()
-    df['state_price_mean'] = df['state'].map(state_means)
-    df['state_price_mean'].fillna(df[target_col].mean(), inplace=True)
+    codes, uniques = pd.factorize(df['state'], sort=False)
+    target = df[target_col].to_numpy(dtype=np.float64)
+    # Null states get code -1 and receive the global mean
+    known = codes >= 0
+    sums = np.bincount(codes[known], weights=target[known], minlength=len(uniques))
+    counts = np.bincount(codes[known], minlength=len(uniques))
+    means = sums / np.maximum(counts, 1)
+    
+    encoded = np.full(len(df), np.nanmean(target) if len(target) else np.nan)
+    encoded[known] = means[codes[known]]
+    df['state_price_mean'] = encoded
+    state_means = dict(zip(uniques, means.tolist()))
     return df, state_means
 
 
-def optimize_hyperparameters(X_train, y_train, n_trials=20):
+def frame_digest(df):
+    """Fast content hash of a DataFrame (values and index)."""
+    row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    if xxhash is not None:
+        return xxhash.xxh64(row_hashes.tobytes()).hexdigest()
+    return hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest()
+
+
+def _feature_code_version():
+    """FEATURE_VERSION salted with the source of the feature functions."""
+    try:
+        source = inspect.getsource(engineer_features) + inspect.getsource(create_state_encoding)
+    except (OSError, TypeError):
+        return FEATURE_VERSION
+    return f"{FEATURE_VERSION}-{hashlib.blake2b(source.encode(), digest_size=8).hexdigest()}"
+
+
+FEATURE_CODE_VERSION = _feature_code_version()
+
+
+@feature_memory.cache(ignore=['df'])
+def _engineer_and_encode(key, feature_version, df):
+    return create_state_encoding(engineer_features(df))
+
+
+def engineer_and_encode(df):
+    """
+    engineer_features + create_state_encoding memoized on disk.
+    
+    The cache key is the content digest of ``df`` plus FEATURE_CODE_VERSION,
+    so retries over the same batch skip the feature computation entirely and
+    edits to the feature functions invalidate old entries. The cache directory
+    is pruned to FEATURE_CACHE_LIMIT after each call.
+    
+    Returns:
+        tuple: (engineered DataFrame, state_means dict)
+    """
+    result = _engineer_and_encode(frame_digest(df), FEATURE_CODE_VERSION, df)
+    feature_memory.reduce_size(bytes_limit=FEATURE_CACHE_LIMIT)
+    return result
+
+
+def log_joblib_artifact(obj, filename, artifact_path=None):
+    """Serialize ``obj`` with joblib into a private temp dir and log it to MLflow."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_path = os.path.join(tmp_dir, filename)
+        joblib.dump(obj, local_path)
+        mlflow.log_artifact(local_path, artifact_path)
+
+
+def export_onnx(fitted_model, n_features):
+    """
+    Convert the fitted tree model (no preprocessor) to ONNX.
+    
+    The graph takes a float32 (n, n_features) tensor named ONNX_INPUT_NAME and,
+    like the fitted model, predicts log1p(price).
+    
+    Returns:
+        onnx.ModelProto, or None if the converters are not installed
+    """
+    if not USE_ONNX:
+        return None
+    initial_types = [(ONNX_INPUT_NAME, FloatTensorType([None, n_features]))]
+    if USE_XGBOOST and isinstance(fitted_model, xgb.XGBModel):
+        if onnxmltools is None:
+            return None
+        return onnxmltools.convert_xgboost(fitted_model, initial_types=initial_types, target_opset=ONNX_OPSET)
+    return to_onnx(fitted_model, initial_types=initial_types, target_opset=ONNX_OPSET)
+
+
+def optimize_hyperparameters(X_train, y_train, n_trials=20, use_xgboost=USE_XGBOOST):
     """
     Use Optuna to find optimal hyperparameters.
+    
+    Args:
+        use_xgboost: Tune XGBoost (True) or HistGradientBoostingRegressor (False).
+    
+    Returns:
+        tuple: (best_params, best_val_rmse) - best_val_rmse is the holdout RMSE
+        (log scale) of the best trial, or None when defaults are used.
     """
     if not USE_OPTUNA:
         logging.info("Optuna not available, returning default hyperparameters")
-        if USE_XGBOOST:
-            return {
+        if use_xgboost:
+            return ({
                 'n_estimators': 200,
                 'max_depth': 6,
                 'learning_rate': 0.1,
@@ -117,16 +365,36 @@ def optimize_hyperparameters(X_train, y_train, n_trials=20):
                 'min_child_weight': 3,
                 'reg_alpha': 0.1,
                 'reg_lambda': 1.0
-            }
+            }, None)
         else:
-            return {
+            return ({
                 'max_iter': 200,
                 'max_depth': 8,
                 'learning_rate': 0.1
-            }
+            }, None)
+    
+    # Internal holdout: one fit per trial with a validation set so trials can be pruned
+    X_tr, X_val, y_tr, y_val = train_test_split(
+        X_train, y_train, test_size=0.2, random_state=42
+    )
+    
+    if use_xgboost:
+        # Features are quantized once and shared by all trials
+        dtrain = xgb.QuantileDMatrix(
+            X_tr.to_numpy(dtype=np.float32), label=np.asarray(y_tr, dtype=np.float32)
+        )
+        dval = xgb.QuantileDMatrix(
+            X_val.to_numpy(dtype=np.float32), label=np.asarray(y_val, dtype=np.float32),
+            ref=dtrain
+        )
+    
+    n_jobs = max(1, min(OPTUNA_N_JOBS, n_trials))
+    # XGBoost threads per trial so parallel trials do not oversubscribe the CPU
+    xgb_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+    device = xgb_device() if use_xgboost else None
     
     def objective(trial):
-        if USE_XGBOOST:
+        if use_xgboost:
             params = {
                 'n_estimators': trial.suggest_int('n_estimators', 100, 500),
                 'max_depth': trial.suggest_int('max_depth', 3, 10),
@@ -136,10 +404,27 @@ def optimize_hyperparameters(X_train, y_train, n_trials=20):
                 'min_child_weight': trial.suggest_int('min_child_weight', 1, 10),
                 'reg_alpha': trial.suggest_float('reg_alpha', 1e-8, 10.0, log=True),
                 'reg_lambda': trial.suggest_float('reg_lambda', 1e-8, 10.0, log=True),
-                'random_state': 42,
-                'n_jobs': -1
             }
-            model = xgb.XGBRegressor(**params)
+            num_boost_round = params.pop('n_estimators')
+            booster_params = {
+                **params,
+                'objective': 'reg:squarederror',
+                'eval_metric': 'rmse',
+                'device': device,
+                'nthread': xgb_threads,
+                'seed': 42
+            }
+            callbacks = None
+            if XGBoostPruningCallback is not None:
+                callbacks = [XGBoostPruningCallback(trial, "validation-rmse")]
+            booster = xgb.train(
+                booster_params, dtrain, num_boost_round=num_boost_round,
+                evals=[(dval, 'validation')], early_stopping_rounds=EARLY_STOPPING_ROUNDS,
+                callbacks=callbacks, verbose_eval=False
+            )
+            # Rounds actually used after early stopping (reused for the final model)
+            trial.set_user_attr('n_estimators', booster.best_iteration + 1)
+            return -booster.best_score
         else:
             params = {
                 'max_iter': trial.suggest_int('max_iter', 100, 500),
@@ -148,29 +433,55 @@ def optimize_hyperparameters(X_train, y_train, n_trials=20):
                 'random_state': 42
             }
             model = HistGradientBoostingRegressor(**params)
+            model.fit(X_tr, y_tr)
         
-        # Use cross-validation
-        scores = cross_val_score(model, X_train, y_train, cv=3, scoring='r2', n_jobs=-1)
-        return scores.mean()
+        rmse = root_mean_squared_error(y_val, model.predict(X_val))
+        return -rmse
     
-    logging.info(f"Starting Optuna optimization with {n_trials} trials...")
-    study = optuna.create_study(direction='maximize', study_name='xgboost_optimization')
-    study.optimize(objective, n_trials=n_trials, show_progress_bar=False)
+    # A persisted study may only be resumed for the same backend and training
+    # data; otherwise best_params could come from another batch or search space
+    backend = "xgboost" if use_xgboost else "hist"
+    study_name = f"{backend}_optimization_{frame_digest(X_train)[:16]}"
+    logging.info(f"Starting Optuna optimization with {n_trials} trials (study: {study_name})...")
+    study = optuna.create_study(
+        direction='maximize',
+        study_name=study_name,
+        pruner=optuna.pruners.MedianPruner(n_warmup_steps=1),
+        storage=OPTUNA_STORAGE,
+        load_if_exists=OPTUNA_STORAGE is not None
+    )
+    study.optimize(objective, n_trials=n_trials, n_jobs=n_jobs, show_progress_bar=False)
     
-    logging.info(f"Best trial: {study.best_trial.number}")
-    logging.info(f"Best R2: {study.best_value:.4f}")
-    logging.info(f"Best params: {study.best_params}")
+    n_pruned = sum(t.state == optuna.trial.TrialState.PRUNED for t in study.trials)
+    logging.info(f"Best trial: {study.best_trial.number} ({n_pruned} pruned)")
+    logging.info(f"Best validation RMSE (log): {-study.best_value:.4f}")
+    best_params = dict(study.best_params)
+    if 'n_estimators' in study.best_trial.user_attrs:
+        best_params['n_estimators'] = study.best_trial.user_attrs['n_estimators']
+    logging.info(f"Best params: {best_params}")
     
-    return study.best_params
+    return best_params, -study.best_value
 
 
-def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"):
+def train_and_log_model(train_df, experiment_name="real_estate_price_prediction", model_backend=None):
     """
     Train model with XGBoost, log to MLflow, and optionally promote to production.
     
+    Args:
+        train_df: Clean training data.
+        experiment_name: MLflow experiment name.
+        model_backend: "xgboost", "hist" (HistGradientBoostingRegressor) or
+            None to use XGBoost when it is installed.
+    
     Returns:
         tuple: (run_id, rmse)
     """
+    if model_backend is None:
+        model_backend = "xgboost" if USE_XGBOOST else "hist"
+    if model_backend not in MODEL_BACKENDS or (model_backend == "xgboost" and not USE_XGBOOST):
+        raise ValueError(f"Unsupported model_backend: {model_backend}")
+    use_xgboost = model_backend == "xgboost"
+    
     try:
         mlflow.set_experiment(experiment_name)
         
@@ -180,13 +491,13 @@ def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"
         logging.info(f"Input data: {len(train_df)} rows")
         
         # Filter outliers
-        p1, p99 = train_df['price'].quantile(0.01), train_df['price'].quantile(0.99)
-        df = train_df[(train_df['price'] >= p1) & (train_df['price'] <= p99)].copy()
+        prices = train_df['price'].to_numpy(dtype=np.float64)
+        p1, p99 = quantile_bounds(prices, 0.01, 0.99)
+        df = train_df[(prices >= p1) & (prices <= p99)].copy()
         logging.info(f"After outlier removal: {len(df)} rows")
         
         # Feature engineering
-        df = engineer_features(df)
-        df, state_means = create_state_encoding(df)
+        df, state_means = engineer_and_encode(df)
         
         # Define features
         feature_names = [
@@ -197,11 +508,14 @@ def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"
         ]
         
         # Prepare data
-        X = df[feature_names].copy()
-        y = df['price'].copy()
+        X_arr = df[feature_names].to_numpy(dtype=np.float32)
+        y = df['price'].astype(np.float32)
         
-        # Handle missing values
-        X.fillna(X.median(), inplace=True)
+        # Handle missing values: medians computed once and filled in place
+        medians = np.nanmedian(X_arr, axis=0)
+        rows, cols = np.where(np.isnan(X_arr))
+        X_arr[rows, cols] = medians[cols]
+        X = pd.DataFrame(X_arr, columns=feature_names, index=df.index)
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
@@ -212,11 +526,13 @@ def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"
         logging.info(f"Test set: {len(X_test)} samples")
         
         # Hyperparameter optimization (limited trials for speed)
-        best_params = optimize_hyperparameters(X_train, np.log1p(y_train), n_trials=10)
+        best_params, best_val_rmse = optimize_hyperparameters(
+            X_train, np.log1p(y_train), n_trials=10, use_xgboost=use_xgboost
+        )
         
         # Create model
-        if USE_XGBOOST:
-            base_model = xgb.XGBRegressor(**best_params, random_state=42, n_jobs=-1)
+        if use_xgboost:
+            base_model = xgb.XGBRegressor(**best_params, random_state=42, device=xgb_device())
             model_type = "XGBRegressor"
         else:
             base_model = HistGradientBoostingRegressor(**best_params, random_state=42)
@@ -225,23 +541,18 @@ def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"
         # Create pipeline with preprocessing
         preprocessor = ColumnTransformer(
             transformers=[
-                ('num', Pipeline([
-                    ('imputer', SimpleImputer(strategy='median')),
-                    ('scaler', StandardScaler())
-                ]), feature_names)
+                # No StandardScaler: trees are invariant to feature scaling
+                ('num', SimpleImputer(strategy='median'), feature_names)
             ],
             remainder='passthrough'
         )
         
-        # Wrap with target transformation
-        model = TransformedTargetRegressor(
-            regressor=Pipeline([
-                ('preprocessor', preprocessor),
-                ('model', base_model)
-            ]),
-            func=log_transform,
-            inverse_func=inverse_log_transform
-        )
+        # The pipeline is trained on log1p(price); predict returns the log scale
+        # and the inverse (expm1) is applied once when predicting
+        model = Pipeline([
+            ('preprocessor', preprocessor),
+            ('model', base_model)
+        ])
         
         with mlflow.start_run(run_name=f"{model_type}_{datetime.now().strftime('%Y%m%d_%H%M')}"):
             run_id = mlflow.active_run().info.run_id
@@ -249,7 +560,7 @@ def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"
             # Log parameters
             mlflow.log_params({
                 "model_type": model_type,
-                "use_xgboost": USE_XGBOOST,
+                "use_xgboost": use_xgboost,
                 "use_optuna": USE_OPTUNA,
                 "target_transform": "log1p",
                 "n_features": len(feature_names),
@@ -260,16 +571,14 @@ def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"
             
             # Train
             logging.info(f"Training {model_type}...")
-            model.fit(X_train, y_train)
+            model.fit(X_train, log_transform(y_train))
             
             # Predict
-            y_pred = model.predict(X_test)
+            y_pred = inverse_log_transform(model.predict(X_test))
             
             # Calculate metrics
-            rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-            mae = mean_absolute_error(y_test, y_pred)
-            r2 = r2_score(y_test, y_pred)
-            mape = calculate_mape(y_test.values, y_pred)
+            metrics = regression_metrics(y_test.to_numpy(), y_pred)
+            rmse, mae, r2, mape = metrics["rmse"], metrics["mae"], metrics["r2"], metrics["mape"]
             
             logging.info("-"*40)
             logging.info("METRICS:")
@@ -287,62 +596,82 @@ def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"
                 "mape": mape
             })
             
-            # Cross-validation
-            cv_scores = cross_val_score(model, X, y, cv=5, scoring='r2', n_jobs=-1)
-            mlflow.log_metrics({
-                "cv_r2_mean": np.mean(cv_scores),
-                "cv_r2_std": np.std(cv_scores)
-            })
-            logging.info(f"CV R2: {np.mean(cv_scores):.4f} (+/- {np.std(cv_scores):.4f})")
+            # Validation score of the best Optuna trial (no CV refit)
+            if best_val_rmse is not None:
+                mlflow.log_metric("optuna_val_rmse_log", best_val_rmse)
+                logging.info(f"Optuna validation RMSE (log): {best_val_rmse:.4f}")
             
             # Save and log model
-            # Save the complete model (includes preprocessing and log transform)
-            joblib.dump(model, "model.pkl")
-            mlflow.log_artifact("model.pkl", "model")
+            # Save the complete model (preprocessing + model; predicts log1p(price))
+            log_joblib_artifact(model, "model.pkl", "model")
             
             # Also save just the fitted model for SHAP
-            fitted_model = model.regressor_.named_steps['model']
-            joblib.dump(fitted_model, "fitted_model.pkl")
-            mlflow.log_artifact("fitted_model.pkl")
+            fitted_model = model.named_steps['model']
+            log_joblib_artifact(fitted_model, "fitted_model.pkl")
             
-            # Save state_means.pkl
-            joblib.dump(state_means, "state_means.pkl")
-            mlflow.log_artifact("state_means.pkl")
+            # ONNX export of the fitted model: the API serves it with onnxruntime (optional)
+            try:
+                onnx_model = export_onnx(fitted_model, len(feature_names))
+                if onnx_model is not None:
+                    with tempfile.TemporaryDirectory() as tmp_dir:
+                        onnx_path = os.path.join(tmp_dir, "model.onnx")
+                        with open(onnx_path, "wb") as f:
+                            f.write(onnx_model.SerializeToString())
+                        mlflow.log_artifact(onnx_path)
+            except Exception as e:
+                logging.warning(f"Could not export model to ONNX: {e}")
             
-            # Save feature names
-            with open("features.txt", "w") as f:
-                f.write("\n".join(feature_names))
-            mlflow.log_artifact("features.txt")
+            # state_means and feature names as JSON, without going through disk
+            mlflow.log_dict(state_means, "state_means.json")
+            mlflow.log_dict({"features": feature_names}, "features.json")
             
-            # Log full pipeline for MLflow model registry
+            # Log full pipeline for MLflow model registry (outputs log1p scale)
             mlflow.sklearn.log_model(
                 sk_model=model,
                 artifact_path="sklearn_model",
                 registered_model_name=MODEL_NAME
             )
             
-            # Create SHAP explainer
-            logging.info("Creating SHAP explainer...")
+            # SHAP: path-dependent TreeSHAP (uses only the trees' own statistics).
+            # The explainer is not persisted: the API rebuilds it from fitted_model.pkl
+            # instead of downloading a second serialized copy of the model.
+            logging.info("Computing SHAP values...")
             try:
-                if USE_XGBOOST:
-                    explainer = shap.TreeExplainer(fitted_model)
-                else:
-                    explainer = shap.TreeExplainer(fitted_model)
-                
-                # Save explainer
-                joblib.dump(explainer, "shap_explainer.pkl")
-                mlflow.log_artifact("shap_explainer.pkl")
-                
-                # Generate and log SHAP summary plot
                 X_sample = X_test.sample(min(100, len(X_test)), random_state=42)
                 # Transform for SHAP
-                X_transformed = model.regressor_.named_steps['preprocessor'].transform(X_sample)
-                shap_values = explainer.shap_values(X_transformed)
+                X_transformed = model.named_steps['preprocessor'].transform(X_sample)
+                
+                # Small, already transformed background for interventional SHAP: TreeSHAP
+                # cost grows with the number of background rows, so never pass all of
+                # X_train. Only needed for interventional explanations
+                # (TreeExplainer(fitted_model, data=background,
+                # feature_perturbation="interventional")); /explain is path-dependent.
+                background = model.named_steps['preprocessor'].transform(
+                    shap.sample(X_train, 100, random_state=42)
+                ).astype(np.float32)
+                log_joblib_artifact(background, "shap_background.pkl")
+                if use_xgboost:
+                    # XGBoost's native TreeSHAP (C++/GPU); the last column is the bias
+                    contribs = fitted_model.get_booster().predict(
+                        xgb.DMatrix(X_transformed), pred_contribs=True
+                    )
+                    shap_values = contribs[:, :-1]
+                else:
+                    explainer = shap.TreeExplainer(
+                        fitted_model, feature_perturbation="tree_path_dependent", model_output="raw"
+                    )
+                    shap_values = explainer.shap_values(X_transformed)
+                
+                # Global importance: mean |SHAP| per feature
+                mean_abs_shap = np.abs(shap_values).mean(axis=0)
+                mlflow.log_dict(
+                    dict(zip(feature_names, mean_abs_shap.tolist())), "shap_importance.json"
+                )
                 
                 mlflow.log_param("shap_explainer_created", True)
-                logging.info("SHAP explainer created and logged")
+                logging.info("SHAP importance computed and logged")
             except Exception as e:
-                logging.warning(f"Could not create SHAP explainer: {e}")
+                logging.warning(f"Could not compute SHAP values: {e}")
                 mlflow.log_param("shap_explainer_created", False)
             
             # Model promotion logic
@@ -368,6 +697,7 @@ def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"
                         stage="Production",
                         archive_existing_versions=True
                     )
+                    client.set_registered_model_alias(MODEL_NAME, PRODUCTION_ALIAS, new_version)
                     mlflow.log_param("promoted_to_production", True)
                     mlflow.log_param("promotion_reason", "Metrics met thresholds")
                 else:
@@ -378,11 +708,6 @@ def train_and_log_model(train_df, experiment_name="real_estate_price_prediction"
             
             logging.info("="*40)
             
-            # Cleanup temp files
-            for f in ["model.pkl", "state_means.pkl", "features.txt", "shap_explainer.pkl"]:
-                if os.path.exists(f):
-                    os.remove(f)
-            
             return run_id, rmse
             
     except Exception as e:
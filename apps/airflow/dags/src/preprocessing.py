@@ -13,6 +13,23 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _string_category(series, fill=''):
+    """
+    Cast a column to a categorical of strings, mapping missing, '' and 'nan' to fill.
+    
+    Labels are normalised on the categories array (O(categories)); rows only
+    carry integer codes, so no Python string is built per cell.
+    """
+    cat = series.astype('category')
+    labels = cat.cat.categories.astype(str).to_numpy(dtype=object)
+    labels[np.isin(labels, ['', 'nan'])] = fill
+    # Extra slot for nulls (code -1 indexes the last element)
+    labels = np.append(labels, fill)
+    categories, remap = np.unique(labels, return_inverse=True)
+    codes = remap[cat.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=series.index, name=series.name)
+
+
 def clean_data(df):
     """
     Comprehensive data cleaning for real estate data.
@@ -23,6 +40,7 @@ def clean_data(df):
     3. Handle missing values
     4. Remove outliers
     5. Validate data ranges
+    6. Compact dtypes (float32 numerics, categorical state/status)
     
     Args:
         df: Raw DataFrame from API
@@ -43,15 +61,16 @@ def clean_data(df):
     # 2. Convert types
     # Numerical columns
     num_cols = ['bed', 'bath', 'acre_lot', 'house_size', 'price']
-    for col in num_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+    present_num = [col for col in num_cols if col in df.columns]
+    if present_num:
+        df[present_num] = df[present_num].apply(pd.to_numeric, errors='coerce')
     
-    # String columns
+    # String columns: categorical, so empty/'nan' labels are fixed once per category
+    str_fill = {'state': 'Unknown', 'status': 'for_sale'}
     str_cols = ['zip_code', 'city', 'state', 'status', 'street', 'brokered_by']
     for col in str_cols:
         if col in df.columns:
-            df[col] = df[col].astype(str).replace('nan', '')
+            df[col] = _string_category(df[col], fill=str_fill.get(col, ''))
     
     # 3. Handle missing values
     # Drop rows with missing critical values
@@ -67,47 +86,43 @@ def clean_data(df):
     if 'acre_lot' in df.columns:
         df['acre_lot'] = df['acre_lot'].fillna(df['acre_lot'].median())
     
-    if 'state' in df.columns:
-        df['state'] = df['state'].replace('', 'Unknown')
-        df['state'] = df['state'].replace('nan', 'Unknown')
-    
-    if 'status' in df.columns:
-        df['status'] = df['status'].replace('', 'for_sale')
-        df['status'] = df['status'].replace('nan', 'for_sale')
-    
-    # 4. Remove outliers
-    # Price outliers (keep 1st to 99th percentile)
-    if 'price' in df.columns and len(df) > 100:
-        p1, p99 = df['price'].quantile(0.01), df['price'].quantile(0.99)
-        before = len(df)
-        df = df[(df['price'] >= p1) & (df['price'] <= p99)]
-        logger.info(f"Removed {before - len(df)} price outliers (range: ${p1:,.0f} - ${p99:,.0f})")
-    
-    # House size outliers
-    if 'house_size' in df.columns and len(df) > 100:
-        p1, p99 = df['house_size'].quantile(0.01), df['house_size'].quantile(0.99)
-        before = len(df)
-        df = df[(df['house_size'] >= p1) & (df['house_size'] <= p99)]
-        logger.info(f"Removed {before - len(df)} house_size outliers")
-    
-    # 5. Validate data ranges
-    # Ensure positive values
-    for col in ['price', 'bed', 'bath', 'acre_lot', 'house_size']:
+    # 4-5. Remove outliers and validate ranges with a single combined mask
+    # (a single filter instead of one copy per condition). Outlier quantiles are
+    # taken in order on the rows still kept, so house_size percentiles are
+    # computed after the price filter, as with sequential filtering
+    mask = np.ones(len(df), dtype=bool)
+    
+    for col in ['price', 'house_size']:
+        if col in df.columns and mask.sum() > 100:
+            kept = df[col].to_numpy()[mask]
+            p1, p99 = np.quantile(kept, [0.01, 0.99])
+            col_mask = (df[col].to_numpy() >= p1) & (df[col].to_numpy() <= p99)
+            logger.info(f"Flagged {(mask & ~col_mask).sum()} {col} outliers (range: {p1:,.0f} - {p99:,.0f})")
+            mask &= col_mask
+    
+    # Ensure positive values and reasonable ranges
+    valid_ranges = {
+        'price': (0, np.inf),
+        'bed': (1, 20),
+        'bath': (0.5, 15),
+        'acre_lot': (0.001, 1000),
+        'house_size': (100, 50000)
+    }
+    for col, (low, high) in valid_ranges.items():
         if col in df.columns:
-            df = df[df[col] > 0]
-    
-    # Reasonable ranges
-    if 'bed' in df.columns:
-        df = df[(df['bed'] >= 1) & (df['bed'] <= 20)]
-    
-    if 'bath' in df.columns:
-        df = df[(df['bath'] >= 0.5) & (df['bath'] <= 15)]
+            values = df[col].to_numpy()
+            mask &= (values > 0) & (values >= low) & (values <= high)
     
-    if 'acre_lot' in df.columns:
-        df = df[(df['acre_lot'] >= 0.001) & (df['acre_lot'] <= 1000)]
+    before = len(df)
+    df = df.loc[mask]
+    logger.info(f"Removed {before - len(df)} rows by outlier/range filters")
     
-    if 'house_size' in df.columns:
-        df = df[(df['house_size'] >= 100) & (df['house_size'] <= 50000)]
+    # 6. Compact dtypes
+    # float32 halves memory for drift checks, storage and training
+    # (string columns are already categorical from step 2)
+    for col in num_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast='float')
     
     logger.info(f"Data cleaning complete. Output rows: {len(df)}")
     
@@ -197,10 +212,11 @@ def validate_data(df, required_cols=None):
     if len(df) == 0:
         raise ValueError("DataFrame is empty")
     
-    # Check for all-null columns
-    for col in required_cols:
-        if df[col].isna().all():
-            raise ValueError(f"Column '{col}' is all null")
+    # Check for all-null columns (a single reduction over all columns)
+    all_null = df[required_cols].isna().all(axis=0)
+    null_cols = all_null.index[all_null.to_numpy()].tolist()
+    if null_cols:
+        raise ValueError(f"Columns are all null: {null_cols}")
     
     logger.info(f"Data validation passed: {len(df)} rows, {len(df.columns)} columns")
     return True
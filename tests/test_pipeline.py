@@ -51,6 +51,26 @@ class TestPreprocessing:
         assert pd.api.types.is_numeric_dtype(cleaned['price'])
         assert pd.api.types.is_numeric_dtype(cleaned['house_size'])
     
+    def test_clean_data_fills_missing_categories(self, sample_raw_data):
+        """Test that missing state/status labels are filled on categorical columns."""
+        from preprocessing import clean_data
+        
+        raw_data = sample_raw_data.copy()
+        raw_data['state'] = raw_data['state'].astype(object)
+        raw_data['status'] = raw_data['status'].astype(object)
+        raw_data.loc[0, 'state'] = None
+        raw_data.loc[1, 'status'] = 'nan'
+        
+        cleaned = clean_data(raw_data)
+        
+        assert isinstance(cleaned['state'].dtype, pd.CategoricalDtype)
+        assert not cleaned['state'].isin(['', 'nan', 'None']).any()
+        assert not cleaned['status'].isin(['', 'nan']).any()
+        if 0 in cleaned.index:
+            assert cleaned.loc[0, 'state'] == 'Unknown'
+        if 1 in cleaned.index:
+            assert cleaned.loc[1, 'status'] == 'for_sale'
+    
     def test_clean_data_filters_outliers(self, sample_raw_data):
         """Test that extreme outliers are handled."""
         from preprocessing import clean_data
@@ -68,6 +88,31 @@ class TestPreprocessing:
         assert len(cleaned) > 0  # Should have some valid records remaining
         assert 'price' in cleaned.columns
     
+    def test_clean_data_house_size_quantiles_follow_price_filter(self):
+        """Test that house_size percentiles are taken after price outliers are removed."""
+        from preprocessing import clean_data
+        
+        rng = np.random.default_rng(0)
+        n = 1000
+        house_size = rng.uniform(500, 5000, n).round()
+        raw_data = pd.DataFrame({
+            'bed': rng.integers(1, 6, n).astype(float),
+            'bath': rng.integers(1, 4, n).astype(float),
+            'acre_lot': rng.uniform(0.1, 1.0, n),
+            'house_size': house_size,
+            'price': (house_size * 300 + rng.normal(0, 1e5, n)).clip(1000),
+            'state': 'California',
+            'status': 'for_sale'
+        })
+        
+        # Baseline semantics: filter price first, then house_size on what is left
+        expected = raw_data[raw_data['price'].between(*raw_data['price'].quantile([0.01, 0.99]))]
+        expected = expected[expected['house_size'].between(*expected['house_size'].quantile([0.01, 0.99]))]
+        
+        cleaned = clean_data(raw_data)
+        
+        assert cleaned.index.tolist() == expected.index.tolist()
+    
     def test_clean_data_preserves_valid_records(self, sample_raw_data):
         """Test that valid records are preserved."""
         from preprocessing import clean_data
@@ -154,6 +199,33 @@ class TestDriftDetection:
         # Should handle gracefully
         has_drift = detect_drift(reference_data_for_drift, empty_df)
         assert isinstance(has_drift, bool)
+    
+    def test_detect_drift_accepts_baseline(self, reference_data_for_drift, current_data_with_drift):
+        """Test that a stored baseline gives the same result as the reference DataFrame."""
+        from drift_detection import detect_drift, build_baseline
+        
+        baseline = build_baseline(reference_data_for_drift)
+        
+        _, from_df = detect_drift(reference_data_for_drift, current_data_with_drift, return_details=True)
+        _, from_baseline = detect_drift(baseline, current_data_with_drift, return_details=True)
+        
+        assert from_baseline['features_with_drift'] == from_df['features_with_drift']
+        assert from_baseline['drift_scores'] == from_df['drift_scores']
+    
+    def test_detect_drift_p_values_match_scipy(self):
+        """Test that small samples use the same (exact) p-values as scipy's ks_2samp."""
+        from scipy.stats import ks_2samp
+        from drift_detection import detect_drift
+        
+        rng = np.random.default_rng(1)
+        reference = pd.DataFrame({'price': rng.normal(500000, 1e5, 60).astype(np.float32)})
+        current = pd.DataFrame({'price': rng.normal(540000, 1e5, 40).astype(np.float32)})
+        
+        _, details = detect_drift(reference, current, return_details=True)
+        
+        expected = ks_2samp(reference['price'], current['price'])
+        assert details['drift_scores']['price']['statistic'] == pytest.approx(expected.statistic)
+        assert details['drift_scores']['price']['p_value'] == pytest.approx(expected.pvalue)
 
 
 class TestPSICalculation:
@@ -183,6 +255,22 @@ class TestPSICalculation:
         
         # Different distributions should have higher PSI
         assert psi > 0.1
+    
+    def test_calculate_psi_matches_histogram_bins(self):
+        """Test that values on bin edges are counted in the same bins as np.histogram."""
+        from drift_detection import calculate_psi
+        
+        ref = np.arange(0, 1.01, 0.01)
+        curr = np.round(np.random.default_rng(0).uniform(0, 1, 50), 1)
+        
+        bin_edges = np.linspace(0, 1, 11)
+        ref_counts, _ = np.histogram(ref, bins=bin_edges)
+        curr_counts, _ = np.histogram(curr, bins=bin_edges)
+        ref_proportions = (ref_counts + 1) / (len(ref) + 10)
+        curr_proportions = (curr_counts + 1) / (len(curr) + 10)
+        expected = np.sum((curr_proportions - ref_proportions) * np.log(curr_proportions / ref_proportions))
+        
+        assert calculate_psi(ref, curr) == pytest.approx(expected)
 
 
 class TestDataLoader:
@@ -191,24 +279,72 @@ class TestDataLoader:
     def test_fetch_data_returns_dataframe(self):
         """Test that fetch_data returns a DataFrame."""
         from unittest.mock import patch, MagicMock
+        import json
         from data_loader import fetch_data
         
         mock_response = MagicMock()
-        mock_response.json.return_value = {
+        mock_response.content = json.dumps({
             'data': [
                 {'bed': 3, 'bath': 2, 'price': 500000},
                 {'bed': 4, 'bath': 3, 'price': 750000}
             ],
             'batch_number': 1
-        }
+        }).encode()
         mock_response.raise_for_status = MagicMock()
+        mock_response.headers = {}
         
-        with patch('data_loader.requests.get', return_value=mock_response):
+        with patch('data_loader.get_fetch_cache', return_value=None), \
+             patch('data_loader.ijson', None), \
+             patch('data_loader.SESSION.get', return_value=mock_response):
             df = fetch_data(group_number="5", day="Tuesday")
             
             assert isinstance(df, pd.DataFrame)
             assert len(df) == 2
     
+    def test_fetch_data_streams_records_with_ijson(self):
+        """Test that records are stream-parsed when ijson is available."""
+        from unittest.mock import patch, MagicMock
+        from io import BytesIO
+        import json
+        from data_loader import fetch_data
+        ijson = pytest.importorskip('ijson')
+        
+        mock_response = MagicMock()
+        mock_response.raw = BytesIO(json.dumps({
+            'data': [
+                {'bed': 3, 'bath': 2, 'price': 500000},
+                {'bed': 4, 'bath': 3.5, 'price': 750000}
+            ],
+            'batch_number': 1
+        }).encode())
+        mock_response.headers = {}
+        
+        with patch('data_loader.get_fetch_cache', return_value=None), \
+             patch('data_loader.ijson', ijson), \
+             patch('data_loader.SESSION.get', return_value=mock_response):
+            df = fetch_data(group_number="5", day="Tuesday")
+            
+            assert len(df) == 2
+            assert df['bath'].tolist() == [2.0, 3.5]
+    
+    def test_fetch_data_uses_cache_on_not_modified(self, sample_raw_data):
+        """Test that a 304 response returns the cached batch."""
+        from unittest.mock import patch, MagicMock
+        from data_loader import fetch_data
+        
+        mock_response = MagicMock()
+        mock_response.status_code = 304
+        cache = ('"abc123"', 'fetch_cache/5_Tuesday.parquet')
+        
+        with patch('data_loader.get_fetch_cache', return_value=cache), \
+             patch('data_loader.load_raw_data', return_value=sample_raw_data.copy()), \
+             patch('data_loader.SESSION.get', return_value=mock_response) as mock_get:
+            df = fetch_data(group_number="5", day="Tuesday")
+            
+            assert df.attrs.get('from_cache') is True
+            assert len(df) == len(sample_raw_data)
+            assert mock_get.call_args.kwargs['headers'] == {'If-None-Match': '"abc123"'}
+    
     def test_save_to_postgres_creates_batch_id(self, sample_clean_data):
         """Test that save_to_postgres generates batch_id."""
         from unittest.mock import patch, MagicMock
@@ -222,6 +358,35 @@ class TestDataLoader:
                 
                 assert batch_id is not None
                 assert 'batch_' in batch_id
+    
+    def test_save_to_postgres_creates_table_with_timestamp(self, sample_clean_data):
+        """Test that the to_sql fallback for a missing table includes the timestamp column."""
+        from unittest.mock import patch, MagicMock
+        from data_loader import save_to_postgres
+        
+        mock_engine = MagicMock()
+        cursor = mock_engine.raw_connection.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (None,)  # table does not exist
+        saved = {}
+        
+        def capture_to_sql(frame, *args, **kwargs):
+            saved['columns'] = list(frame.columns)
+        
+        with patch('data_loader.get_db_engine', return_value=mock_engine):
+            with patch.object(pd.DataFrame, 'to_sql', autospec=True, side_effect=capture_to_sql):
+                save_to_postgres(sample_clean_data, 'raw_data')
+        
+        assert 'batch_id' in saved['columns']
+        assert 'ingestion_timestamp' in saved['columns']
+    
+    def test_csv_text_io_streams_same_csv(self, sample_raw_data):
+        """Test that CsvTextIO yields the same bytes as DataFrame.to_csv."""
+        from data_loader import CsvTextIO
+        
+        stream = CsvTextIO(sample_raw_data, chunk_rows=2)
+        chunks = iter(lambda: stream.read(16), b'')
+        
+        assert b''.join(chunks) == sample_raw_data.to_csv(index=False).encode()
 
 
 class TestFeatureEngineering:
@@ -275,6 +440,47 @@ class TestFeatureEngineering:
 class TestModelTraining:
     """Tests for model training logic."""
     
+    def test_state_encoding_matches_groupby_mean(self, sample_clean_data):
+        """Test that state target encoding equals the per-state price mean."""
+        from model_training import create_state_encoding
+        
+        df = sample_clean_data.copy()
+        expected = df.groupby('state')['price'].mean()
+        
+        encoded, state_means = create_state_encoding(df)
+        
+        for state, mean in expected.items():
+            assert state_means[state] == pytest.approx(mean)
+        assert np.allclose(encoded['state_price_mean'], df['state'].map(expected))
+    
+    def test_quantile_bounds_match_pandas(self):
+        """Test that partition-based outlier bounds equal Series.quantile."""
+        from model_training import quantile_bounds
+        
+        np.random.seed(42)
+        prices = pd.Series(np.random.lognormal(13, 0.5, 1001))
+        prices.iloc[0] = np.nan
+        
+        p1, p99 = quantile_bounds(prices, 0.01, 0.99)
+        
+        assert p1 == pytest.approx(prices.quantile(0.01))
+        assert p99 == pytest.approx(prices.quantile(0.99))
+    
+    def test_regression_metrics_match_sklearn(self):
+        """Test that fused metrics equal the sklearn implementations."""
+        from model_training import regression_metrics
+        from sklearn.metrics import root_mean_squared_error, mean_absolute_error, r2_score
+        
+        np.random.seed(42)
+        y_true = np.random.lognormal(13, 0.5, 500).astype(np.float32)
+        y_pred = y_true * np.random.uniform(0.8, 1.2, 500).astype(np.float32)
+        
+        metrics = regression_metrics(y_true, y_pred)
+        
+        assert metrics["rmse"] == pytest.approx(root_mean_squared_error(y_true, y_pred), rel=1e-5)
+        assert metrics["mae"] == pytest.approx(mean_absolute_error(y_true, y_pred), rel=1e-5)
+        assert metrics["r2"] == pytest.approx(r2_score(y_true, y_pred), rel=1e-5)
+    
     def test_model_training_returns_metrics(self, sample_clean_data):
         """Test that training returns expected metrics."""
         from unittest.mock import patch, MagicMock